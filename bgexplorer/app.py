@@ -1,4 +1,5 @@
 import flask
+import jinja2
 from flask import Flask, render_template, Blueprint, json, flash, redirect, url_for, Response, abort
 from flask_bootstrap import Bootstrap
 from flask_basicauth import BasicAuth
@@ -68,6 +69,10 @@ class BgExplorer(Flask):
         BgExplorer uses some special keys in configuration:
             SIMDBVIEWS_DEFAULT (str): the default SimDbView to use if not specified.
                 If not provided, it will be set to the first registered view
+            JINJA_BYTECODE_CACHE (bool): cache compiled templates on disk so
+                they are not recompiled by every worker (default False)
+            JINJA_BYTECODE_CACHE_DIR (str): directory for the template cache.
+                If not provided, use 'jinja_cache' in the instance path
         """
         if instance_path is None:
             caller = inspect.stack()[1][1]
@@ -83,6 +88,15 @@ class BgExplorer(Flask):
         if config_filename:
             app.config.from_pyfile(config_filename)
 
+        # compile templates once rather than per worker process
+        if app.config.setdefault('JINJA_BYTECODE_CACHE', False):
+            cachedir = app.config.get('JINJA_BYTECODE_CACHE_DIR')
+            if not cachedir:
+                cachedir = os.path.join(app.instance_path, 'jinja_cache')
+            os.makedirs(cachedir, exist_ok=True)
+            app.jinja_env.bytecode_cache = \
+                jinja2.FileSystemBytecodeCache(cachedir)
+
         # override json encode/decode to handle object IDs
         app.json_encoder = CustomJSONEncoder
         app.json_decoder = CustomJSONDecoder
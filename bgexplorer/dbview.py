@@ -63,6 +63,8 @@ class SimsDbView(object):
         self.spectra_units = spectra_units or {}
         self.values_spectra = values_spectra or {}
         self.upload_handler = upload_handler
+        self._datatable_header = None
+        self._values_spectra_lookup = None
 
         #replace groupsort nested lists with joined strings
         for key,val in list(self.groupsort.items()):
@@ -90,6 +92,42 @@ class SimsDbView(object):
     def __str__(self):
         return self.__repr__()
 
+    def datatable_header(self):
+        """ Get the header line for the datatable generated from this view.
+        The header only depends on `groups`, `values`, and `values_units`, so
+        it is cached until one of them changes
+        """
+        key = (tuple(self.groups), tuple(self.values),
+               tuple(self.values_units.items()))
+        cached = self._datatable_header
+        if cached is None or cached[0] != key:
+            valheads = ['V_'+v+(' [%s]'%self.values_units[v]
+                                if v in self.values_units else '')
+                        for v in self.values]
+            header = '\t'.join(itertools.chain(
+                ['ID'], ('G_'+g for g in self.groups), valheads)) + '\n'
+            cached = self._datatable_header = (key, header)
+        return cached[1]
+
+    def get_value_spectrum(self, valname):
+        """ Get the name of the spectrum associated to the value `valname`
+        through `values_spectra`. `valname` may include the unit suffix
+        applied in the datatable header
+        Returns:
+            str: key in `spectra`, or None if there is no associated spectrum
+        """
+        #rebuild the lookup if either source dict has changed
+        key = (tuple(self.values_spectra.items()),
+               tuple(self.values_units.items()))
+        cached = self._values_spectra_lookup
+        if cached is None or cached[0] != key:
+            lookup = dict(self.values_spectra)
+            for val, specname in self.values_spectra.items():
+                if val in self.values_units:
+                    lookup['%s [%s]'%(val, self.values_units[val])] = specname
+            cached = self._values_spectra_lookup = (key, lookup)
+        return cached[1].get(valname)
+
     def flatten_gval(self, gval):
         """ Group evaluation functions can produce a list or tuple. This
         function converts to a string by joining each value with the join key
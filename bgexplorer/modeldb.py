@@ -4,10 +4,11 @@ from __future__ import (absolute_import, division,
 
 import pymongo
 import re
+import threading
 from pprint import pprint 
 import bson
 from datetime import datetime
-from collections import OrderedDict, deque
+from collections import OrderedDict
 from bgmodelbuilder.bgmodel import BgModel
 from .utils import getobjectid
 import logging
@@ -16,46 +17,48 @@ log = logging.getLogger(__name__)
 class InMemoryCacher(object):
     def __init__(self, maxentries=3):
         """Simple cache of most recently assembled models from the database. 
-        If new models are cached the oldest are removed first
+        Once there are more than `maxentries`, the least recently used entry
+        is removed, where both `store` and `get` count as a use. Storing a
+        key that is already present keeps the old value. Safe to share
+        between threads
         """
-        self.maxentries = 3
+        self.maxentries = maxentries
+        self._lock = threading.RLock()
         self.empty()
 
     def store(self, key, val):
-        if key in self.registry:
-            return key
-        self.registry[key] = val
-        self.byage.appendleft(key)
-        if len(self.byage) > self.maxentries:
-            self.expire()
+        with self._lock:
+            if key in self.registry:
+                return key
+            self.registry[key] = val
+            if len(self.registry) > self.maxentries:
+                self.expire()
         return key
 
     def get(self, key):
         #move this key to the top of the age queue
-        if key in self.byage and self.byage.index(key) != 0:
-            self.byage.remove(key)
-            self.byage.appendleft(key)
-        return self.registry.get(key, None)
+        with self._lock:
+            try:
+                self.registry.move_to_end(key)
+            except KeyError:
+                return None
+            return self.registry[key]
         
     def test(self, key):
         return key in self.registry
         
     def expire(self, key=None):
-        if not key:
-            key = self.byage.pop()
-        else:
-            try:
-                self.byage.remove(key)
-            except ValueError: 
-                pass
-        try:
-            del self.registry[key]
-        except KeyError:
-            pass
+        #registry is ordered oldest first
+        with self._lock:
+            if not key:
+                if self.registry:
+                    self.registry.popitem(last=False)
+                return
+            self.registry.pop(key, None)
         
     def empty(self):
-        self.byage = deque([])
-        self.registry = {}
+        with self._lock:
+            self.registry = OrderedDict()
 
     
 
@@ -77,6 +80,7 @@ class ModelDB(object):
         self._database = None
         self._collection = None
         self._cacher = cacher
+        self._historycache = InMemoryCacher(maxentries=256)
         
         if dburi:
             self.connect(dburi)
@@ -113,6 +117,9 @@ class ModelDB(object):
                                       name='name_version',
                                       unique=True,
                                       partialFilterExpression=partialFilter);
+        #del_model checks for descendants before deleting
+        self._collection.create_index('derivedFrom', name='derivedFrom',
+                                      sparse=True)
         
     def testconnection(self):
         """Make sure we're connected to the database, otherwise raise exception
@@ -196,16 +203,32 @@ class ModelDB(object):
            with the most recent first
         """
         result = []
+        permanent = []
         projection = {'name': True, 'version': True, 'editDetails':True, 
                       'derivedFrom':True}
         while modelid:
-            model = self.get_raw_model(modelid, projection)
+            #saved models never change, so their history can be reused
+            cached = self._historycache.get(str(modelid))
+            if cached is not None:
+                result.extend(cached)
+                permanent.extend([True]*len(cached))
+                break
+            model = self.get_raw_model(modelid, dict(projection),
+                                       withmeta=True)
             if model:
+                meta = model.pop('__modeldb_meta', {})
                 result.append(model)
+                permanent.append(not meta.get('temporary', True))
                 modelid = model.get('derivedFrom',None)
             else:
                 modelid = None
-        return result
+        #cache the tail of the chain below the first temporary model
+        for index in range(len(result)-1, -1, -1):
+            if not permanent[index]:
+                break
+            self._historycache.store(str(result[index]['_id']),
+                                     result[index:])
+        return list(result)
 
     def get_current_version(self, modelname, includetemp=False):
         """Get the most recent version number for a given model name"""
@@ -425,11 +448,13 @@ class ModelDB(object):
         if not model:
             raise KeyError("No model with id %s"%modelid)
         #see if any models derive from this
-        derived = self._collection.count({'derivedFrom':query['_id']})
+        derived = self._collection.count_documents(
+            {'derivedFrom':query['_id']}, limit=1)
         if derived:
             raise ValueError("Can't delete model with descendants")
         
         self._cacher.expire(modelid)
+        self._historycache.expire(str(modelid))
         return self._collection.delete_one(query).deleted_count
                 
     def get_models_list(self, includetemp=False, mostrecentonly=True,
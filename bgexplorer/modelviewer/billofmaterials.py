@@ -1,38 +1,72 @@
 """ functions and classes for building the bill of materials """
 from flask import g
-from collections import namedtuple, OrderedDict
+from collections import OrderedDict
 from bgmodelbuilder.utilities import Isotope
 from bgmodelbuilder import units
 
-BOMRow = namedtuple('BOMRow',('outline','path','component',
-                              'weight','totalweight'))
-
-def getbomrows(row=None, form="%02d"):
-    """Recursive function to generate list of bomrows
+class BOMRow(object):
+    """One line in the bill of materials. Slotted since large assemblies
+    allocate one per placement
+    """
+    __slots__ = ('outline','parent','component','weight','totalweight')
+
+    def __init__(self, outline, component, weight, totalweight, parent=None):
+        self.outline = outline
+        self.parent = parent
+        self.component = component
+        self.weight = weight
+        self.totalweight = totalweight
+
+    @property
+    def path(self):
+        """Tuple of components from the root assembly down to this one"""
+        path = []
+        row = self
+        while row is not None:
+            path.append(row.component)
+            row = row.parent
+        return tuple(reversed(path))
+
+def _outline1(prefix, index):
+    return f"{prefix}{index}"
+
+def _outline2(prefix, index):
+    return f"{prefix}{index:02d}"
+
+def getbomrows(row=None):
+    """Generate bomrows in depth-first (outline) order
+    Args:
+        row (BOMRow): root of the tree to list. If None, use the
+                      assemblyroot of g.model
     """
     if not row:
         row = BOMRow(outline='',
-                     path=(g.model.assemblyroot,),
                      component=g.model.assemblyroot,
                      weight=1,
                      totalweight=1)
 
-    myrows = [row]
-
-    parent = row.component
-    subs = parent.getcomponents(deep=False, withweight=True)
-    if subs:
-        form = "%02d" if len(subs)>10 else "%d"
-        for index, cw in enumerate(subs):
-            child, weight = cw
-            outlineprefix = row.outline+'.' if row.outline else ''
-            childrow = BOMRow(outline=("%s"+form)%(outlineprefix,index+1),
-                              path=row.path+(child,),
-                              component=child,
-                              weight=weight,
-                              totalweight=row.totalweight*weight)
-            myrows.extend(getbomrows(childrow, form=form))
-    return myrows
+    #shared subassemblies appear under many parents; list their children once
+    childcache = g.setdefault('bomchildren', {})
+    stack = [row]
+    pop, push = stack.pop, stack.extend
+    while stack:
+        row = pop()
+        yield row
+        parent = row.component
+        subs = childcache.get(id(parent))
+        if subs is None:
+            subs = parent.getcomponents(deep=False, withweight=True)
+            childcache[id(parent)] = subs
+        if not subs:
+            continue
+        outline = _outline2 if len(subs)>10 else _outline1
+        outlineprefix = row.outline+'.' if row.outline else ''
+        totalweight = row.totalweight
+        children = [BOMRow(outline(outlineprefix, index), child,
+                           weight, totalweight*weight, row)
+                    for index, (child, weight) in enumerate(subs, 1)]
+        #push in reverse so the first child is visited next
+        push(reversed(children))
 
 
 def getdefaultcols():
@@ -1,22 +1,39 @@
 #python 2/3 compatibility
 from __future__ import (absolute_import, division,
                         print_function, unicode_literals)
-from itertools import chain
+from collections import defaultdict
 from flask import (Blueprint, render_template, request, abort, url_for, g,
                    Response, make_response, current_app)
 import threading
+import multiprocessing
+import atexit
+import weakref
+import jinja2
 import zlib
-import json
+import gzip
+import hashlib
 import numpy as np
 from uncertainties import unumpy
 from math import ceil, log10
+from numbers import Real
 from io import BytesIO
+from werkzeug.wsgi import wrap_file
+import os
+from concurrent.futures import (ThreadPoolExecutor, ProcessPoolExecutor,
+                                TimeoutError as FutureTimeoutError)
+from concurrent.futures.process import BrokenProcessPool
 try:
     from matplotlib.figure import Figure
 except ImportError:
     Figure = None
-
-from bson import ObjectId
+try:
+    from isal import isal_zlib
+except ImportError:
+    isal_zlib = None
+try:
+    import brotli
+except ImportError:
+    brotli = None
 
 from .. import utils
 from ..dbview import SimsDbView
@@ -28,7 +45,7 @@ from bgmodelbuilder import units
 import logging
 log = logging.getLogger(__name__)
 
-from time import sleep
+from time import sleep, monotonic
 
 def make_etag(model):
     """ Generate a string to use as an etag """
@@ -38,6 +55,173 @@ def make_etag(model):
         # this should be a dictionary...
         return f"{model['_id']}-{model['editDetails']['date']}"
 
+def compress_stream(chunks, level=6):
+    """Deflate an iterable of bytes, yielding compressed chunks as soon as
+    the compressor produces them. If isal is installed it produces the same
+    format faster, but it only supports levels 0-3, so it is used only for
+    those levels
+    Args:
+        chunks: iterable of bytes objects
+        level (int): zlib compression level
+    """
+    if (isal_zlib is not None
+        and 0 <= level <= isal_zlib.ISAL_BEST_COMPRESSION):
+        compressor = isal_zlib.compressobj(level)
+    else:
+        compressor = zlib.compressobj(level)
+    for chunk in chunks:
+        out = compressor.compress(chunk)
+        if out:
+            yield out
+    yield compressor.flush()
+
+def split_errors(vals):
+    """ Split an array into nominal values and standard deviations. Plain
+    numeric arrays skip the much slower per-element `uncertainties` path
+    Args:
+        vals: array, possibly of ufloats and possibly with units
+    Returns:
+        tuple of (nominal values, errors) as plain ndarrays
+    """
+    vals = getattr(vals, 'm', vals)
+    arr = np.asarray(vals)
+    if arr.dtype != object:
+        return arr, np.zeros(arr.shape)
+    return unumpy.nominal_values(arr), unumpy.std_devs(arr)
+
+def iter_datasets(matches):
+    """ Yield the dataset ids of each match in `matches`. A match's `dataset`
+    may be a single id or a list of them
+    """
+    for match in matches:
+        datasets = match.dataset
+        if not datasets:
+            continue
+        if isinstance(datasets, str) or not hasattr(datasets, '__iter__'):
+            yield datasets
+        else:
+            yield from datasets
+
+def list_datasets(matches):
+    """ List each dataset id used by `matches` once, in order of first use.
+    The same dataset often backs several matches
+    """
+    return list(dict.fromkeys(iter_datasets(matches)))
+
+_figures = threading.local()
+
+def render_spectrum_png(x, y, yerr, title=None, logx=True, logy=True,
+                        xlabel=None, ylabel=None):
+    """ Render a spectrum to png bytes. Takes only plain arrays and strings so
+    it can run in a worker process
+    Args:
+        x: lower bin edges
+        y: bin values
+        yerr: bin errors
+        title (str): title
+        logx (bool): set x axis to log scale
+        logy (bool): set y axis to log scale
+        xlabel (str): x axis label
+        ylabel (str): y axis label
+    Returns:
+        bytes of the png image
+    """
+    #reuse this thread's figure; building one is a good part of the cost
+    fig = getattr(_figures, 'fig', None)
+    if fig is None:
+        fig = _figures.fig = Figure()
+        ax = _figures.ax = fig.subplots()
+    else:
+        ax = _figures.ax
+        ax.clear()
+    ax.errorbar(x=x, y=y, yerr=yerr,
+                drawstyle='steps-post',
+                elinewidth=0.6,
+                )
+    ax.set_title(title)
+    if logx:
+        ax.set_xscale('log')
+    if logy:
+        ax.set_yscale('log')
+    if xlabel:
+        ax.set_xlabel(xlabel)
+    if ylabel:
+        ax.set_ylabel(ylabel)
+    out = BytesIO()
+    fig.savefig(out, format='png')
+    return out.getvalue()
+
+class StreamBuffer(object):
+    """Bytes written by one thread that any number of readers can stream
+    while they are still being written
+    """
+    def __init__(self):
+        self._data = bytearray()
+        self._cond = threading.Condition()
+        self.finished = False
+        self.failed = False
+
+    def write(self, chunk):
+        with self._cond:
+            self._data += chunk
+            self._cond.notify_all()
+
+    def close(self, failed=False):
+        """Mark the buffer complete, or abandoned if `failed`"""
+        with self._cond:
+            self.finished = True
+            self.failed = failed
+            self._cond.notify_all()
+
+    def wait(self, timeout=None):
+        """Block until the buffer is closed. Returns False if it failed"""
+        with self._cond:
+            self._cond.wait_for(lambda: self.finished, timeout)
+            return self.finished and not self.failed
+
+    def getvalue(self):
+        with self._cond:
+            return bytes(self._data)
+
+    def iterchunks(self):
+        """Yield the contents as they arrive, from the beginning. Raises
+        RuntimeError if the writer fails, so a response using this is cut
+        off rather than silently truncated
+        """
+        offset = 0
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: (self.finished or
+                                             len(self._data) > offset))
+                chunk = bytes(self._data[offset:])
+                finished, failed = self.finished, self.failed
+            offset += len(chunk)
+            if chunk:
+                yield chunk
+            if finished:
+                if failed:
+                    raise RuntimeError("Stream was abandoned by its writer")
+                return
+
+#stop the pools of every live ModelViewer at exit, without keeping them alive
+_viewers = weakref.WeakSet()
+
+@atexit.register
+def _shutdown_viewers():
+    for viewer in list(_viewers):
+        viewer.shutdown()
+
+def g_cached(key, func, *args):
+    """Call `func(*args)` at most once per request, keeping the result on
+    `flask.g` under `key`
+    """
+    cache = g.setdefault('mv_cache', {})
+    try:
+        return cache[key]
+    except KeyError:
+        result = cache[key] = func(*args)
+        return result
+
 class ModelViewer(object):
     """Blueprint for inspecting saved model definitions
     Args:
@@ -47,6 +231,23 @@ class ModelViewer(object):
     """
     defaultversion='HEAD'
     joinkey='___'
+    #url_for arguments that add_model translates
+    url_object_keys = frozenset(('model', 'modelid', 'permalink',
+                                 'component', 'spec', 'match'))
+    #matches evaluated together per datatable batch
+    datatable_batch_size = 256
+    #threads evaluating each batch. simsdb backends are not required to be
+    #thread safe, so rows are evaluated serially unless this is raised
+    datatable_eval_threads = 1
+    #levels 0-3 use isal if it is installed
+    datatable_zlib_level = 6
+    #processes rendering spectrum images, per app worker
+    render_workers = 2
+    #seconds to trust a cached etag for the default version; 0 disables
+    head_etag_ttl = 30
+    spectrum_mimetypes = {'tsv': 'text/tab-separated-value',
+                          'csv': 'text/csv',
+                          'png': 'image/png'}
 
     def __init__(self, app=None, modeldb=None,
                  cacher=InMemoryCacher(), url_prefix='/explore'):
@@ -58,15 +259,34 @@ class ModelViewer(object):
                             template_folder='templates',
                             url_prefix='/<modelname>/<version>')
 
-        self.bp.add_app_template_global(lambda : self, 'getmodelviewer')
+        self.bp.add_app_template_global(self._get_modelviewer,
+                                        'getmodelviewer')
         self.set_url_processing()
         self.register_endpoints()
 
         if self.app:
             self.init_app(app, url_prefix)
 
-        self._threads = {}
+        self._pending = {}
+        self._pending_lock = threading.Lock()
         self._cacher = cacher
+        #exports and spectra are only kept if caching is enabled at all
+        self._exports = InMemoryCacher(maxentries=4) if cacher else None
+        self._spectra = InMemoryCacher(maxentries=64) if cacher else None
+        #brotli copies of cached datatables
+        self._brdatatables = InMemoryCacher(maxentries=3)
+        self._etags = InMemoryCacher(maxentries=1000)
+        self._permalinks = InMemoryCacher(maxentries=4096)
+        self._head_etags = InMemoryCacher(maxentries=1000)
+        #kept apart from `_cacher` so they never push out a datatable
+        self._componentsorts = InMemoryCacher(maxentries=100)
+        self._render_pool = None
+        self._render_pool_lock = threading.Lock()
+        self._eval_pool = None
+        self._eval_pool_lock = threading.Lock()
+        self._build_pool = None
+        self._build_pool_lock = threading.Lock()
+        _viewers.add(self)
         #### User Overrides ####
         self.bomcols = bomfuncs.getdefaultcols()
 
@@ -76,9 +296,30 @@ class ModelViewer(object):
         app.register_blueprint(self.bp,
                                url_prefix=url_prefix+self.bp.url_prefix)
         app.extensions['ModelViewer'] = self
+        #datatables are built outside the app context, so read config now
+        self.datatable_batch_size = app.config.get('DATATABLE_BATCH_SIZE',
+                                                   self.datatable_batch_size)
+        self.datatable_zlib_level = app.config.get('DATATABLE_ZLIB_LEVEL',
+                                                   self.datatable_zlib_level)
+        self.datatable_eval_threads = app.config.get(
+            'DATATABLE_EVAL_THREADS', self.datatable_eval_threads)
+        self.head_etag_ttl = app.config.get('HEAD_ETAG_TTL',
+                                            self.head_etag_ttl)
+        self.render_workers = app.config.get('SPECTRUM_RENDER_WORKERS',
+                                             self.render_workers)
+        #compile our templates at startup rather than on first request
+        for name in self.bp.jinja_loader.list_templates():
+            try:
+                app.jinja_env.get_template(name)
+            except jinja2.TemplateError as e:
+                log.warning(f"Unable to precompile template {name}: {e}")
 
 
 
+    def _get_modelviewer(self):
+        """Template global returning this ModelViewer"""
+        return self
+
     @property
     def modeldb(self):
         return self._modeldb or utils.get_modeldb()
@@ -97,25 +338,39 @@ class ModelViewer(object):
         @self.bp.after_request
         def addpostheaders(response):
             """ Add cache-control headers to all modelviewer responses """
-            if self.app.config.get('NO_CLIENT_CACHE'):
-                return
-            # todo: add Last-Modified
+            # leave alone errors, redirects, and views that set their own
+            if (current_app.config.get('NO_CLIENT_CACHE')
+                or response.status_code >= 300
+                or 'Cache-Control' in response.headers):
+                return response
             response.headers["Cache-Control"] = "private, max-age=100"
+            model = g.get('model')
+            if model is None: # model is not loaded in g
+                return response
             try:
-                response.headers['ETag'] = make_etag(g.model)
-            except (AttributeError, KeyError): # model is not loaded in g
+                response.headers['ETag'] = make_etag(model)
+            except (AttributeError, KeyError):
                 pass
             return response
 
         @self.bp.url_defaults
         def add_model(endpoint, values):
-            model = values.pop('model', None) or g.get('model', None)
+            #nothing to fill in or convert for fully specified URLs
+            if ('modelname' in values and 'version' in values
+                and values.keys().isdisjoint(self.url_object_keys)):
+                return
+            model = values.pop('model', None)
+            if model:
+                name, version = self.get_modelref(model)
+            else:
+                model = g.get('model', None)
+                if model:
+                    #every url_for on a page uses g.model, so resolve it once
+                    ref = g.get('modelref')
+                    if ref is None or ref[0] is not model:
+                        ref = g.modelref = (model,)+self.get_modelref(model)
+                    _, name, version = ref
             if model:
-                #model could be object or dict
-                name = getattr(model,'name', None) or model.get('name',None)
-                version = getattr(model,'version', None)
-                if version is None and hasattr(model,'get'):
-                    version = model.get('version',None)
                 values.setdefault('modelname', name)
                 permalink = values.pop('permalink',None)
                 if permalink is not None:
@@ -142,6 +397,7 @@ class ModelViewer(object):
         def find_model(endpoint, values):
             # URL has different formats that result in different queries
             query = None
+            version = None
             if 'modelid' in values:
                 query = values.pop('modelid')
             elif 'modelname' in values:
@@ -159,24 +415,87 @@ class ModelViewer(object):
             # view. So we have to do the cache checking here
             etagreq = request.headers.get('If-None-Match')
             if etagreq and not self.app.config.get('NO_CLIENT_CACHE'):
-                # construct the etag from the DB entry
-                projection = {'editDetails.date': True}
-                modeldict = self.modeldb.get_raw_model(query, projection)
-                etag = make_etag(modeldict)
-                if etagreq == etag:
+                etag, modelid = self.lookup_model_etag(query, etagreq)
+                if etag and etagreq == etag:
                     abort(make_response('', '304 Not Modified',{'ETag': etag}))
+                if modelid:
+                    # already resolved, so load directly by ID
+                    query = modelid
 
             # if we get here, it's not in client cache
             g.model = utils.getmodelordie(query,self.modeldb)
             if version == self.defaultversion:
-                g.permalink = url_for(endpoint, permalink=True,
-                                      **values)
+                key = (endpoint, g.model.id, tuple(sorted(values.items())))
+                permalink = self._permalinks.get(key)
+                if permalink is None:
+                    permalink = url_for(endpoint, permalink=True, **values)
+                    self._permalinks.store(key, permalink)
+                g.permalink = permalink
             g.simsdbview = utils.get_simsdbview(model=g.model)
             #construct the cached datatable in the background
             if self._cacher:
                 self.build_datatable(g.model)
 
 
+    @staticmethod
+    def get_modelref(model):
+        """Get the name and version of a model object or dict
+        Returns:
+            tuple: (name, version)
+        """
+        name = getattr(model,'name', None) or model.get('name',None)
+        version = getattr(model,'version', None)
+        if version is None and hasattr(model,'get'):
+            version = model.get('version',None)
+        return name, version
+
+    def lookup_model_etag(self, query, etagreq=None):
+        """ Get the etag for the model matching `query` without building it.
+        Permanent models are never modified, so when the query pins a
+        specific ID or version of one the result is remembered; temporary
+        models are always looked up. Lookups of the
+        default version are remembered for `head_etag_ttl` seconds, but only
+        to confirm an `etagreq` the client already has; any other answer
+        comes from the DB, since HEAD may have moved in the meantime
+        Args:
+            query: model ID or query dict
+            etagreq (str): etag from the client's If-None-Match header
+        Returns:
+            tuple: (etag, model ID), or (None, None) if no model matches
+        """
+        pinned = not isinstance(query, dict) or bool({'_id', 'version'}
+                                                       & query.keys())
+        querykey = (tuple(sorted(query.items())) if isinstance(query, dict)
+                    else query)
+        if pinned:
+            cached = self._etags.get(querykey)
+            if cached:
+                return cached
+        elif self.head_etag_ttl:
+            #HEAD can move, so only trust a recent answer
+            cached = self._head_etags.get(querykey)
+            if (cached and cached[1] > monotonic()
+                and etagreq is not None and cached[0][0] == etagreq):
+                return cached[0]
+        # construct the etag from the DB entry
+        projection = {'editDetails.date': True}
+        modeldict = self.modeldb.get_raw_model(query, projection,
+                                               withmeta=True)
+        if not modeldict:
+            return None, None
+        result = (make_etag(modeldict), modeldict['_id'])
+        #temporary models can be edited or deleted by other processes, so
+        #only remember models the DB says are permanent
+        meta = modeldict.get('__modeldb_meta', {})
+        if pinned and meta.get('temporary') is False:
+            self._etags.store(querykey, result)
+        elif not pinned and self.head_etag_ttl:
+            self._head_etags.expire(querykey)
+            self._head_etags.store(querykey,
+                                   (result, monotonic()+self.head_etag_ttl))
+        return result
+
+
     def register_endpoints(self):
         """Define the view functions here"""
 
@@ -191,7 +510,7 @@ class ModelViewer(object):
             if componentid:
                 component = utils.getcomponentordie(g.model, componentid)
                 matches = g.model.getsimdata(component=component)
-                datasets = sum((m.dataset or [] for m in matches), [])
+                datasets = list_datasets(matches)
                 return render_template("componentview.html",
                                        component=component, datasets=datasets)
             else:
@@ -208,12 +527,8 @@ class ModelViewer(object):
         def emissionview(specid):
             spec = utils.getspecordie(g.model, specid)
             #find all simulation datasets associated to this spec
-            matches = []
-            if spec.getrootspec() == spec:
-                matches = g.model.getsimdata(rootspec=spec)
-            else:
-                matches = g.model.getsimdata(spec=spec)
-            datasets = sum((m.dataset or [] for m in matches), [])
+            matches = self.get_spec_matches(g.model, spec)
+            datasets = list_datasets(matches)
             return render_template('emissionview.html', spec=spec,
                                    matches=matches, datasets=datasets)
 
@@ -224,11 +539,13 @@ class ModelViewer(object):
         @self.bp.route('/queries/')
         def queriesoverview():
             #build a unique list of all queries
-            queries = {}
+            queries = defaultdict(list)
+            #matches often share the same query object; only format it once
+            keys = {}
             for m in g.model.getsimdata():
-                key = str(m.query)
-                if key not in queries:
-                    queries[key] = []
+                key = keys.get(id(m.query))
+                if key is None:
+                    key = keys[id(m.query)] = str(m.query)
                 queries[key].append(m)
 
             return render_template('queriesoverview.html',queries=queries)
@@ -242,7 +559,6 @@ class ModelViewer(object):
         @self.bp.route('/simdatamatch/<matchid>')
         def simdatamatchview(matchid):
             match = utils.getsimdatamatchordie(g.model, matchid)
-            linkspec = match.spec.getrootspec()
             return render_template("simdatamatchview.html", match=match)
 
 
@@ -275,108 +591,137 @@ class ModelViewer(object):
         @self.bp.route('/export')
         def export():
             """Present the model as a JSON document"""
-            d = g.model.todict()
-            #replace ObjectIds with strings
-            if isinstance(d.get('_id'), ObjectId):
-                d['_id'] = str(d['_id'])
-            if isinstance(d.get('derivedFrom'), ObjectId):
-               d['derivedFrom'] = str(d['derivedFrom'])
-            return Response(json.dumps(d), mimetype="application/json")
+            return self.get_export(g.model)
 
         @self.bp.route('/getspectrum')
         @self.bp.route('/getspectrum/<specname>')
         def getspectrum(specname=None):
+            model, simsdbview = g.model, g.simsdbview
             # get the generator for the spectrum
             if not specname:
                 valname = request.args.get('val')
                 if not valname:
                     abort(404, "Either spectrum name or value name is required")
-                specname = g.simsdbview.values_spectra.get(valname)
-                if not specname:
-                    # valname might have a unit suffix applied to it
-                    index = valname.rfind(' [')
-                    valname = valname[:index]
-                    specname = g.simsdbview.values_spectra.get(valname)
+                specname = simsdbview.get_value_spectrum(valname)
                 if not specname:
                     abort(404, f"No spectrum associated to value '{valname}'")
-            speceval = g.simsdbview.spectra.get(specname)
+            speceval = simsdbview.spectra.get(specname)
             if speceval is None:
                 abort(404, f"No spectrum generator for '{specname}'")
 
-            log.debug(f"Generating spectrum: {specname}")
-            title = specname
-            # get the matches
-            matches = request.args.getlist('m')
-            try:
-                matches = [g.model.simdata[m] for m in matches]
-            except KeyError:
-                abort(404, "Request for unknown sim data match")
-            if not matches:
-                # matches may be filtered by component or spec
-                component = None
-                if 'componentid' in request.args:
-                    component = utils.getcomponentordie(g.model,
-                                                        request.args['componentid'])
-                    title += ", Component = "+component.name
-                rootspec = None
-                if 'specid' in request.args:
-                    rootspec = utils.getspecordie(g.model,
-                                                  request.args['specid'])
-                    title += ", Source = "+rootspec.name
-                matches = g.model.getsimdata(rootcomponent=component, rootspec=rootspec)
-
-            # test for a group filter
-            groupname = request.args.get('groupname')
-            groupval = request.args.get('groupval')
-            if groupname and groupval and groupval != g.simsdbview.groupjoinkey:
-                try:
-                    groupfunc = g.simsdbview.groups[groupname]
-                except KeyError:
-                    abort(404, f"No registered grouping function {groupname}")
-                def _filter_group(match):
-                    mgval = g.simsdbview.evalgroup(match, groupname, False)
-                    return g.simsdbview.is_subgroup(mgval, groupval)
-                matches = list(filter(_filter_group, matches))
-                title += ", "+groupname+" = "
-                title += '/'.join(g.simsdbview.unflatten_gval(groupval, True))
-
-            if not matches:
-                abort(404, "No sim data matching query")
-
-            spectrum = self.simsdb.evaluate([speceval], matches)[0]
-            if not hasattr(spectrum, 'hist') or not hasattr(spectrum, 'bin_edges'):
-                abort(500, f"Error generating spectrum, got {type(spectrum)}")
-
-            unit = g.simsdbview.spectra_units.get(specname, None)
-            if unit is not None:
-                try:
-                    spectrum.hist.ito(unit)
-                except AttributeError: #not a quantity
-                    pass
-
             fmt = request.args.get("format", "png").lower()
-            response = None
-            if fmt == 'tsv':
-                response = Response(self.streamspectrum(spectrum, sep='\t'),
-                                    mimetype='text/tab-separated-value')
-            elif fmt == 'csv':
-                response = Response(self.streamspectrum(spectrum, sep=','),
-                                    mimetype='text/csv')
-            elif fmt == 'png':
-                response = self.specimage(spectrum, title=title)
-            else:
+            mimetype = self.spectrum_mimetypes.get(fmt)
+            if mimetype is None:
                 abort(400, f"Unhandled format specifier {fmt}")
 
+            #identical queries on the same model version give the same output
+            etag = self.spectrumetag(model, specname, fmt, request.args)
+            if request.headers.get('If-None-Match') == etag:
+                abort(make_response('', '304 Not Modified', {'ETag': etag}))
+            body = self._spectra.get(etag) if self._spectra else None
+            if body is None:
+                body = self.buildspectrum(model, simsdbview, specname,
+                                          speceval, fmt)
+                if self._spectra:
+                    self._spectra.store(etag, body)
+
+            if fmt == 'png':
+                response = self.pngresponse(body)
+            else:
+                response = Response(body, mimetype=mimetype)
+            #spectra are expensive, but only keep them long if the URL pins
+            #the model version; find_model sets a permalink otherwise
+            if g.get('permalink') is None:
+                response.headers['Cache-Control'] = "private, max-age=3600"
+            else:
+                response.headers['Cache-Control'] = "private, max-age=100"
+            response.headers['ETag'] = etag
             return response
 
+    @staticmethod
+    def spectrumetag(model, specname, fmt, args):
+        """ Digest of everything that determines a /getspectrum response """
+        sig = repr((make_etag(model), specname, fmt,
+                    sorted(args.getlist('m')),
+                    args.get('componentid'), args.get('specid'),
+                    args.get('groupname'), args.get('groupval')))
+        return hashlib.blake2b(sig.encode('utf-8'), digest_size=16).hexdigest()
+
+    def buildspectrum(self, model, simsdbview, specname, speceval, fmt):
+        """ Evaluate a spectrum for the matches selected by the request args
+        Args:
+            model: the BgModel
+            simsdbview (SimsDbView): view defining the spectrum
+            specname (str): name of the spectrum
+            speceval: spectrum generator from `simsdbview.spectra`
+            fmt (str): one of 'tsv', 'csv', or 'png'
+        Returns:
+            bytes of the formatted spectrum
+        """
+        log.debug(f"Generating spectrum: {specname}")
+        title = specname
+        # get the matches
+        matchids = request.args.getlist('m')
+        simdata = model.simdata
+        matches = [simdata.get(m) for m in matchids]
+        for m, match in zip(matchids, matches):
+            if match is None:
+                abort(404, f"Request for unknown sim data match {m}")
+        if not matches:
+            # matches may be filtered by component or spec
+            component = None
+            if 'componentid' in request.args:
+                component = utils.getcomponentordie(model,
+                                                    request.args['componentid'])
+                title += ", Component = "+component.name
+            rootspec = None
+            if 'specid' in request.args:
+                rootspec = utils.getspecordie(model,
+                                              request.args['specid'])
+                title += ", Source = "+rootspec.name
+            matches = model.getsimdata(rootcomponent=component, rootspec=rootspec)
+
+        # test for a group filter
+        groupname = request.args.get('groupname')
+        groupval = request.args.get('groupval')
+        if groupname and groupval and groupval != simsdbview.groupjoinkey:
+            if groupname not in simsdbview.groups:
+                abort(404, f"No registered grouping function {groupname}")
+            # split the requested group once rather than for every match
+            groupval = simsdbview.unflatten_gval(groupval, True)
+            evalgroup = simsdbview.evalgroup
+            is_subgroup = simsdbview.is_subgroup
+            matches = [m for m in matches
+                       if is_subgroup(evalgroup(m, groupname, False),
+                                      groupval)]
+            title += ", "+groupname+" = "
+            title += '/'.join(groupval)
+
+        if not matches:
+            abort(404, "No sim data matching query")
+
+        spectrum = self.simsdb.evaluate([speceval], matches)[0]
+        if not hasattr(spectrum, 'hist') or not hasattr(spectrum, 'bin_edges'):
+            abort(500, f"Error generating spectrum, got {type(spectrum)}")
+
+        unit = simsdbview.spectra_units.get(specname, None)
+        if unit is not None and isinstance(spectrum.hist, units.Quantity):
+            spectrum.hist.ito(unit)
+
+        if fmt == 'png':
+            return self.specpng(spectrum, title=title)
+        sep = '\t' if fmt == 'tsv' else ','
+        return ''.join(self.streamspectrum(spectrum, sep=sep)).encode('utf-8')
+
     def streamspectrum(self, spectrum, sep=',', include_errs=True,
-                       fmt='{:.5g}'):
+                       fmt='%.5g', chunksize=1024):
         """ Return a generator response for a spectrum
         Args:
             spectrum (Histogram): spectrum to stream
             sep (str): separator (e.g. csv or tsv)
             include_errs (bool): if True, include a column for errors
-            fmt (str): format specifier
+            fmt (str): printf-style format specifier for values and errors
+            chunksize (int): number of rows to send per yielded chunk
         Returns:
             generator to construct Response
         """
@@ -399,10 +744,96 @@ class ModelViewer(object):
             vals = vals.m
         if bins_has_units:
             bins = bins.m
-        vals, errs = unumpy.nominal_values(vals), unumpy.std_devs(vals)
+        vals, errs = split_errors(vals)
+
+        # format whole columns at once rather than row by row
+        nrows = len(vals)
+        rows = np.char.mod('%s', np.asarray(bins)[:nrows])
+        columns = [vals, errs] if include_errs else [vals]
+        for column in columns:
+            rows = np.char.add(np.char.add(rows, sep),
+                               np.char.mod(fmt, column))
+        for start in range(0, nrows, chunksize):
+            yield '\n'.join(rows[start:start+chunksize].tolist())+'\n'
+
+    @property
+    def eval_pool(self):
+        """Thread pool for evaluating datatable rows, used only when
+        `datatable_eval_threads` is more than 1
+        """
+        with self._eval_pool_lock:
+            if self._eval_pool is None:
+                self._eval_pool = ThreadPoolExecutor(
+                    max_workers=self.datatable_eval_threads,
+                    thread_name_prefix='datatable-eval')
+        return self._eval_pool
+
+    @property
+    def build_pool(self):
+        """Thread pool for building cached datatables. Bounded so bursts of
+        new models don't all compress at once
+        """
+        with self._build_pool_lock:
+            if self._build_pool is None:
+                self._build_pool = ThreadPoolExecutor(
+                    max_workers=min(4, os.cpu_count() or 1),
+                    thread_name_prefix='datatable')
+        return self._build_pool
 
-        for abin, aval, anerr in zip(bins, vals, errs):
-            yield sep.join((str(abin), fmt.format(aval), fmt.format(anerr)))+'\n'
+    @property
+    def render_pool(self):
+        """Process pool for rendering images. Started on first use so it is
+        created after any server worker fork. By then this process has other
+        threads running, so workers are not forked from it but started by a
+        forkserver (or spawned where that is unavailable). Either way each
+        worker imports the main script as `__mp_main__`, so scripts that build
+        the app at import time should skip that under that name
+        """
+        with self._render_pool_lock:
+            if self._render_pool is None:
+                if 'forkserver' in multiprocessing.get_all_start_methods():
+                    ctx = multiprocessing.get_context('forkserver')
+                    #the default would run the server's main script again;
+                    #workers only need this module
+                    ctx.set_forkserver_preload([__name__])
+                else:
+                    ctx = multiprocessing.get_context('spawn')
+                self._render_pool = ProcessPoolExecutor(
+                    max_workers=max(1, self.render_workers),
+                    mp_context=ctx)
+        return self._render_pool
+
+    def discard_render_pool(self, pool):
+        """Stop using `pool` for rendering, killing any renders still running
+        in it. The next render starts a new pool. Does nothing if `pool` was
+        already replaced by another thread
+        """
+        with self._render_pool_lock:
+            if self._render_pool is not pool:
+                return
+            self._render_pool = None
+        #a running future can't be cancelled, so stop its process directly
+        processes = list((getattr(pool, '_processes', None) or {}).values())
+        pool.shutdown(wait=False, cancel_futures=True)
+        for process in processes:
+            process.terminate()
+
+    def shutdown(self, wait=True):
+        """Stop the render, evaluation and datatable build pools. Called at
+        exit; they are started again if used afterwards
+        """
+        with self._render_pool_lock:
+            pool, self._render_pool = self._render_pool, None
+        if pool is not None:
+            pool.shutdown(wait=wait)
+        with self._eval_pool_lock:
+            pool, self._eval_pool = self._eval_pool, None
+        if pool is not None:
+            pool.shutdown(wait=wait)
+        with self._build_pool_lock:
+            pool, self._build_pool = self._build_pool, None
+        if pool is not None:
+            pool.shutdown(wait=wait)
 
     def specimage(self, spectrum, title=None, logx=True, logy=True):
         """ Generate a png image of a spectrum
@@ -414,6 +845,22 @@ class ModelViewer(object):
         Returns:
             a Response object
         """
+        return self.pngresponse(self.specpng(spectrum, title, logx, logy))
+
+    @staticmethod
+    def pngresponse(png):
+        """ Wrap png bytes in a Response """
+        #let the server hand the buffer off directly (e.g. wsgi.file_wrapper)
+        return Response(wrap_file(request.environ, BytesIO(png)),
+                        content_type='image/png',
+                        direct_passthrough=True,
+                        headers={'Content-Length': len(png),
+                                 'Content-Disposition': 'inline',
+                                 },
+                        )
+
+    def specpng(self, spectrum, title=None, logx=True, logy=True):
+        """ Render a spectrum to png bytes. See `specimage` for arguments """
         if Figure is None:
             abort(500, "Matplotlib is not available")
         log.debug("Generating spectrum image")
@@ -422,56 +869,40 @@ class ModelViewer(object):
             x = spectrum.bin_edges.m
         except AttributeError:
             x = spectrum.bin_edges
-        fig = Figure()
-        ax = fig.subplots()
-        ax.errorbar(x=x[:-1],
-                    y=unumpy.nominal_values(spectrum.hist),
-                    yerr=unumpy.std_devs(spectrum.hist),
-                    drawstyle='steps-post',
-                    elinewidth=0.6,
-                    )
-        ax.set_title(title)
-        if logx:
-            ax.set_xscale('log')
-        if logy:
-            ax.set_yscale('log')
+        xlabel = ylabel = None
         if hasattr(spectrum.bin_edges, 'units'):
-            ax.set_xlabel(f'Bin [{spectrum.bin_edges.units}]')
+            xlabel = f'Bin [{spectrum.bin_edges.units}]'
         if hasattr(spectrum.hist, 'units'):
-            ax.set_ylabel(f"Value [{spectrum.hist.units}]")
-
-        """
-        #limit to at most N decades...
-        maxrange = 100000
-        ymin, ymax = plt.ylim()
-        ymax = 10**ceil(log10(ymax))
-        ymin = max(ymin, ymax/maxrange)
-        plt.ylim(ymin, ymax)
-        plt.tick_params(which='major',length=6, width=1)
-        plt.tick_params(which='minor',length=4,width=1)
-        iplt.gcf().set_size_inches(9,6)
-        plt.gca().set_position((0.08,0.1,0.7,0.8))
-        """
-        log.debug("Rendering...")
-        out = BytesIO()
-        fig.savefig(out, format='png')
+            ylabel = f"Value [{spectrum.hist.units}]"
+        args = (np.asarray(x[:-1]), *split_errors(spectrum.hist),
+                title, logx, logy, xlabel, ylabel)
+        #rendering is CPU bound, so do it in another process. If a worker
+        #died, the pool is unusable; replace it and try once more
+        for attempt in range(2):
+            pool = self.render_pool
+            try:
+                png = pool.submit(render_spectrum_png, *args).result(
+                    timeout=30)
+                break
+            except BrokenProcessPool:
+                log.warning("Spectrum render pool broke; restarting it")
+                self.discard_render_pool(pool)
+            except FutureTimeoutError:
+                #don't leave the stuck render holding a worker
+                self.discard_render_pool(pool)
+                abort(503, "Timed out rendering spectrum image")
+        else:
+            abort(503, "Unable to render spectrum image")
         log.debug("Done generating image")
-        size = out.tell()
-        out.seek(0)
-        res = Response(out.getvalue(),
-                       content_type='image/png',
-                       headers={'Content-Length': size,
-                                'Content-Disposition': 'inline',
-                                },
-                       )
-        return res
+        return png
 
 
 
 
     #need to pass simsdb because it goes out of context
     def streamdatatable(self, model, simsdbview=None):
-        """Stream exported data table so it doesn't all go into mem at once
+        """Stream exported data table so it doesn't all go into mem at once.
+        Rows are yielded as utf-8 encoded bytes, one chunk per batch of matches
         """
         log.debug(f"Generating data table for model {model.id}")
         #can't evaluate values if we don't have a simsdb
@@ -479,45 +910,69 @@ class ModelViewer(object):
             simsdbview = utils.get_simsdbview(model=model) or SimsDbView()
         simsdb = simsdbview.simsdb
         valitems = list(simsdbview.values.values())
-        matches = model.simdata.values()
+        matches = list(model.simdata.values())
+        groupfuncs = list(simsdbview.groups.values())
+        joinkey = simsdbview.groupjoinkey
+        def fmtgroup(val):
+            return joinkey.join(val) if isinstance(val,(list,tuple)) else val
+        rowfmt = '\t'.join(['%s']*(1+len(groupfuncs)+len(valitems)))+'\n'
+        valunits = [simsdbview.values_units.get(v) for v in simsdbview.values]
+        fmt = "{:.3g}".format
         #send the header
-        valheads = ['V_'+v+(' [%s]'%simsdbview.values_units[v]
-                            if v in simsdbview.values_units else '')
-                    for v in simsdbview.values]
-        yield('\t'.join(chain(['ID'],
-                              ('G_'+g for g in simsdbview.groups),
-                              valheads))
-              +'\n')
-        #loop through matches
-        for match in matches:
-            evals = []
-            if valitems:
-                evals = simsdb.evaluate(valitems, match)
-                for index, vlabel in enumerate(simsdbview.values):
+        yield simsdbview.datatable_header().encode('utf-8')
+
+        def evaluated():
+            """evaluate each batch of matches, in order. Use the backend's
+            evaluate_many if it has one, else spread them over the pool if
+            `datatable_eval_threads` allows
+            """
+            batchsize = max(1, self.datatable_batch_size)
+            evaluate = lambda match: simsdb.evaluate(valitems, match)
+            evaluate_many = getattr(simsdb, 'evaluate_many', None)
+            pool = self.eval_pool if self.datatable_eval_threads > 1 else None
+            for start in range(0, len(matches), batchsize):
+                batch = matches[start:start+batchsize]
+                if not valitems:
+                    yield batch, ([] for match in batch)
+                elif evaluate_many is not None:
+                    yield batch, evaluate_many(valitems, batch)
+                elif pool is not None:
+                    yield batch, pool.map(evaluate, batch)
+                else:
+                    yield batch, map(evaluate, batch)
+
+        #loop through matches, sending one encoded chunk per batch
+        nvals = len(valunits)
+        for batch, batchevals in evaluated():
+            batchvals = []
+            for evals in batchevals:
+                for index, unit in enumerate(valunits):
+                    val = evals[index]
                     # convert to unit if provided
-                    unit = simsdbview.values_units.get(vlabel,None)
-                    if unit:
+                    if unit and isinstance(val, units.Quantity):
                         try:
-                            evals[index] = evals[index].to(unit).m
-                        except AttributeError: #not a Quantity...
-                            pass
+                            val = val.to(unit).m
                         except units.errors.DimensionalityError as e:
-                            if evals[index] != 0 :
+                            if val != 0 :
                                 log.warning(e)
-                            evals[index] = getattr(evals[index], 'm', 0)
-                    # convert to string
-                    evals[index] = "{:.3g}".format(evals[index])
-                    if match.spec.islimit:
-                        evals[index] = '<'+evals[index]
-
-            groupvals = (g(match) for g in simsdbview.groups.values())
-            groupvals = (simsdbview.groupjoinkey.join(g)
-                         if isinstance(g,(list,tuple)) else g
-                         for g in groupvals)
-            yield('\t'.join(chain([match.id],
-                                  (str(g) for g in groupvals),
-                                  evals))
-                  +'\n')
+                            val = getattr(val, 'm', 0)
+                    batchvals.append(val)
+            # convert to string, all at once if they are plain numbers
+            if batchvals and all(isinstance(v, Real) for v in batchvals):
+                batchvals = np.char.mod('%.3g',
+                                        np.array(batchvals, dtype=np.float64))
+                batchvals = batchvals.tolist()
+            else:
+                batchvals = [fmt(v) for v in batchvals]
+
+            rows = []
+            for index, match in enumerate(batch):
+                evals = batchvals[index*nvals:(index+1)*nvals]
+                if match.spec.islimit:
+                    evals = ['<'+val for val in evals]
+                groupvals = map(fmtgroup, [gf(match) for gf in groupfuncs])
+                rows.append(rowfmt % (match.id, *groupvals, *evals))
+            yield ''.join(rows).encode('utf-8')
             #sleep(0.2) # needed to release the GIL
         log.debug(f"Finished generating data table for model {model.id}")
 
@@ -535,76 +990,171 @@ class ModelViewer(object):
         Returns:
             None if no cacher is defined
             0 if the result is already cached
-            Thread created to generate the cache otherwise
+            StreamBuffer receiving the compressed table as it is generated
+            otherwise
         """
         #don't bother to call if we don't have a cache
         if not self._cacher:
             return None
 
-        #TODO: self._threads and self._Cacher should probably be mutexed
-        #see if there's already a worker
         key = self.datatablekey(model)
-        if key in self._threads:
-            return self._threads[key]
-        #see if it's already cached
-        if self._cacher.test(key):
-            return 0
+        with self._pending_lock:
+            #see if there's already a worker
+            if key in self._pending:
+                return self._pending[key]
+            #see if it's already cached
+            if self._cacher.test(key):
+                return 0
+            buf = self._pending[key] = StreamBuffer()
 
         #if we get here, we need to generate it
         def cachedatatable(dbview):
-            compressor = zlib.compressobj()
-            res = b''.join(compressor.compress(s.encode('utf-8'))
-                           for s in self.streamdatatable(model, dbview))
-            res += compressor.flush()
-            self._cacher.store(key, res)
-            self._threads.pop(key) #is this a bad idea???
+            failed = True
+            try:
+                for chunk in compress_stream(self.streamdatatable(model,
+                                                                  dbview),
+                                             self.datatable_zlib_level):
+                    buf.write(chunk)
+                self._cacher.store(key, buf.getvalue())
+                failed = False
+            except Exception:
+                #the pool would otherwise swallow this silently
+                log.exception(f"Unable to generate datatable {key}")
+            finally:
+                #store before releasing readers so later requests find it
+                with self._pending_lock:
+                    del self._pending[key]
+                buf.close(failed)
         dbview = utils.get_simsdbview(model=model)
-        thread = threading.Thread(target=cachedatatable,name=key,
-                                  args=(dbview,))
-        self._threads[key] = thread
-        thread.start()
-        return thread
+        self.build_pool.submit(cachedatatable, dbview)
+        return buf
 
     def get_datatable(self, model):
         """Return a Result object with the encoded or streamed datatable"""
         key = self.datatablekey(model)
+        headers = {'Content-Type':'text/plain;charset=utf-8',
+                   'Vary':'Accept-Encoding',
+                   }
         if not self._cacher: # or self.modeldb.is_model_temp(model.id):
-            #no cache, so stream it directly, don't bother to zip it
+            #no cache, so stream it, compressing only if the client can read it
             #should really be text/csv, but then browsersr won't let you see it
-            return Response(self.streamdatatable(model), mimetype='text/plain')
+            body = self.streamdatatable(model)
+            if request.accept_encodings['deflate'] > 0:
+                body = compress_stream(body, self.datatable_zlib_level)
+                headers['Content-Encoding'] = 'deflate'
+            return Response(body, headers=headers)
 
-        if not self._cacher.test(key):
-            thread = self.build_datatable(model)
-            if thread:
-                thread.join() #wait until it's done
         res = self._cacher.get(key)
+        if res is None:
+            pending = self.build_datatable(model)
+            if pending:
+                #send what has been compressed so far and follow the build
+                headers['Content-Encoding'] = 'deflate'
+                return Response(pending.iterchunks(), headers=headers)
+            res = self._cacher.get(key)
         if not res:
             abort(500,"Unable to generate datatable")
-        return Response(res, headers={'Content-Type':'text/plain;charset=utf-8',
-                                      'Content-Encoding':'deflate',
-                                      })
+        encoding = 'deflate'
+        if brotli is not None and request.accept_encodings['br'] > 0:
+            #recompress once from the cached deflate stream
+            brres = self._brdatatables.get(key)
+            if brres is None:
+                brres = brotli.compress(zlib.decompress(res), quality=4)
+                self._brdatatables.store(key, brres)
+            res, encoding = brres, 'br'
+        headers['Content-Encoding'] = encoding
+        return Response(res, headers=headers)
+
 
+    @staticmethod
+    def get_spec_matches(model, spec):
+        """Return the sim data matches for `spec`, or for all of its subspecs
+        if it is a root spec. Results are kept for the rest of the request
+        """
+        return g_cached(('specmatches', model.id, spec.id),
+                        ModelViewer._find_spec_matches, model, spec)
+
+    @staticmethod
+    def _find_spec_matches(model, spec):
+        if spec.getrootspec() == spec:
+            return model.getsimdata(rootspec=spec)
+        return model.getsimdata(spec=spec)
+
+    @staticmethod
+    def exportkey(model):
+        return "export:"+make_etag(model)
 
-    def get_componentsort(self, component, includeself=True):
+    def get_export(self, model):
+        """Return a Response with the model JSON, gzipped if the client
+        accepts it. The compressed document is cached until the model changes
+        """
+        if not self._exports:
+            #nothing to keep, so send it as it is serialized
+            return Response(utils.iterdumpjson(model.todict()),
+                            mimetype="application/json")
+        key = self.exportkey(model)
+        blob = self._exports.get(key)
+        if blob is None:
+            blob = gzip.compress(utils.dumpjson(model.todict()),
+                                 compresslevel=6)
+            self._exports.store(key, blob)
+        if request.accept_encodings['gzip'] <= 0:
+            return Response(gzip.decompress(blob),
+                            mimetype="application/json",
+                            headers={'Vary': 'Accept-Encoding'})
+        return Response(blob, mimetype="application/json",
+                        headers={'Content-Encoding': 'gzip',
+                                 'Vary': 'Accept-Encoding'})
+
+    def get_componentsort(self, component, includeself=True, memo=None):
         """Return an array component names in assembly order to be passed
         to the javascript analyzer for sorting component names
+        Args:
+            memo (dict): child lists of shared subassemblies already visited,
+                         keyed by component id
         """
-        #TODO: cache this
-        result = [component.name] if includeself  else []
-        for child in component.getcomponents(merge=False):
-            branches = self.get_componentsort(child)
-            if includeself:
-                branches = [self.joinkey.join((component.name, s))
-                            for s in branches]
-            result.extend(branches)
+        if memo is None:
+            memo = {}
+        def children(comp):
+            kids = memo.get(comp.id)
+            if kids is None:
+                kids = memo[comp.id] = list(comp.getcomponents(merge=False))
+            return kids
+
+        #iterative preorder walk; each entry carries its parents' names
+        if includeself:
+            stack = [(component, ())]
+        else:
+            stack = [(child, ()) for child in reversed(children(component))]
+        result = []
+        while stack:
+            comp, prefix = stack.pop()
+            path = prefix + (comp.name,)
+            result.append(self.joinkey.join(path))
+            stack.extend((child, path) for child in reversed(children(comp)))
         return result
 
 
+    @staticmethod
+    def componentsortkey(model):
+        return "componentsort:"+make_etag(model)
+
     def get_groupsort(self):
+        """Get the group sort lists for the current model, once per request"""
+        return g_cached('groupsort', self._build_groupsort)
+
+    def _build_groupsort(self):
         res = dict(**g.simsdbview.groupsort)
         #todo: set up provided lists
         if 'Component' not in res:
-            res['Component'] = self.get_componentsort(g.model.assemblyroot, False)
+            #the assembly order only changes when the model does
+            key = self.componentsortkey(g.model)
+            compsort = self._componentsorts.get(key)
+            if compsort is None:
+                compsort = self.get_componentsort(g.model.assemblyroot, False,
+                                                  memo={})
+                self._componentsorts.store(key, compsort)
+            res['Component'] = compsort
         return res
 
     def eval_matches(self, matches, dovals=True, dospectra=False):
@@ -7,28 +7,42 @@ from flask import (Blueprint, render_template, render_template_string,
 from .. import utils
 import io
 
+def _build_simmatch_index(model):
+    """Map each dataset id to the simdatamatch objects that use it"""
+    index = {}
+    for match in model.getsimdata():
+        datasets = match.dataset
+        if isinstance(datasets, str) or not hasattr(datasets, '__iter__'):
+            datasets = (datasets,)
+        for dataset in datasets:
+            try:
+                matches = index.setdefault(dataset, [])
+            except TypeError:
+                continue
+            #a match may list the same dataset more than once
+            if not matches or matches[-1] is not match:
+                matches.append(match)
+    return index
+
 def findsimmatches(dataset, model=None):
     """find all simdatamatch objects associated with the given dataset"""
-    res = []
     model = g.get('model', model)
     if not model:
-        return res
+        return []
     #make sure we're not working with a full dataset object
     try:
         dataset = dataset.get('_id')
     except AttributeError:
         pass
 
-    for match in model.getsimdata():
-        if match.dataset == dataset:
-            res.append(match)
-        else:
-            try:
-                if dataset in match.dataset:
-                    res.append(match)
-            except TypeError:
-                pass
-    return res
+    #index the model's matches once per request
+    cached = g.get('simmatchindex')
+    if cached is None or cached[0] is not model:
+        cached = g.simmatchindex = (model, _build_simmatch_index(model))
+    try:
+        return list(cached[1].get(dataset, ()))
+    except TypeError:
+        return []
 
 
 class SimsViewer(object):
@@ -91,11 +105,9 @@ class SimsViewer(object):
 
     def getcolnames(self, sims):
         """ Get the column names to display in summary table """
-        columns = []
-        try:
-            columns = g.simsdbview.summarycolumns
-        except AttributeError:
-            pass
+        #copy so inferred columns never get appended to the view's own list
+        columns = list(getattr(g.get('simsdbview'), 'summarycolumns', None)
+                       or ())
         if sims and not columns:
             #non-underscore keys with string or number values
             for key, val in sims[0].items():
@@ -174,7 +186,6 @@ class SimsViewer(object):
             """ Upload files to be inserted, return JSON response """
             files = request.files.getlist('fupload')
             if request.is_json:
-                print(request.data, request.json)
                 fakefile = io.BytesIO(request.data)
                 fakefile.filename = 'JSON'
                 files = [fakefile]
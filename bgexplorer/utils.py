@@ -1,4 +1,13 @@
 from flask import current_app, abort
+from bson import ObjectId
+import json
+import math
+from datetime import date
+import numpy as np
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 
 #todo: should we raise aborts on failure?
@@ -62,14 +71,14 @@ def getdatasetordie(datasetid, simsdb=None):
     simsdb = simsdb or get_simsdb()
     if not simsdb:
         abort(501, "No registered simulations database")
-    return simsdb.getdatasetdetails(dataset)
+    return simsdb.getdatasetdetails(datasetid)
 
 def getsimdatamatchordie(model, matchid):
     """try to find the SimDataMatch with matchid or return 404"""
     match = model.simdata.get(matchid)
     if not match:
         abort(404, "Model %s has no SimDataMatch with ID %s" %
-              (model._id, specid))
+              (model._id, matchid))
     return match
 
 def getobjectid(obj):
@@ -82,3 +91,72 @@ def getobjectid(obj):
         except AttributeError:
             pass
     return obj
+
+def _jsondefault(obj):
+    """Serialize ObjectIds as strings, and dates in ISO format like orjson.
+    numpy scalars and float subclasses, which orjson refuses, are converted
+    to the plain python type
+    """
+    if isinstance(obj, ObjectId):
+        return str(obj)
+    if isinstance(obj, np.generic):
+        return obj.item()
+    if isinstance(obj, float):
+        return float(obj)
+    if isinstance(obj, date):
+        return obj.isoformat()
+    raise TypeError(f"Object of type {type(obj).__name__} "
+                    "is not JSON serializable")
+
+def _finite(obj):
+    """Copy `obj`, replacing NaN and infinite floats with None"""
+    if isinstance(obj, np.generic):
+        obj = obj.item()
+    if isinstance(obj, float):
+        return obj if math.isfinite(obj) else None
+    if isinstance(obj, dict):
+        return {key: _finite(val) for key, val in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return [_finite(val) for val in obj]
+    return obj
+
+def dumpjson(obj):
+    """Serialize `obj` to compact, utf-8 JSON bytes, converting any ObjectIds
+    to strings. Uses orjson if it is installed, otherwise the standard json
+    module, which is set up to give the same output. In particular NaN and
+    infinite values are written as null either way, since JSON has no
+    literal for them
+    """
+    if orjson is not None:
+        return orjson.dumps(obj, default=_jsondefault,
+                            option=orjson.OPT_NON_STR_KEYS)
+    kwargs = dict(default=_jsondefault, ensure_ascii=False,
+                  separators=(',', ':'), allow_nan=False)
+    try:
+        text = json.dumps(obj, **kwargs)
+    except ValueError:
+        #only documents with non-finite numbers pay for the extra pass
+        text = json.dumps(_finite(obj), **kwargs)
+    return text.encode('utf-8')
+
+def iterdumpjson(obj, chunksize=65536):
+    """Like `dumpjson`, but yield the document in pieces of roughly
+    `chunksize` bytes. The top level of a dict is emitted key by key so the
+    whole document is never held in memory at once
+    """
+    if not isinstance(obj, dict):
+        yield dumpjson(obj)
+        return
+    buf = bytearray(b'{')
+    for index, (key, val) in enumerate(obj.items()):
+        if index:
+            buf += b','
+        #let dumpjson format non-string keys, then strip the ':0}'
+        buf += dumpjson({key: 0})[1:-3]
+        buf += b':'
+        buf += dumpjson(val)
+        if len(buf) >= chunksize:
+            yield bytes(buf)
+            buf.clear()
+    buf += b'}'
+    yield bytes(buf)
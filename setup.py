@@ -29,4 +29,7 @@ setup(name='bgexplorer',
           'uncertainties',
           'bgmodelbuilder @ git+https://github.com/bloer/bgmodelbuilder@0.4.2',
       ],
+      extras_require={
+          'speedups': ['orjson', 'isal', 'brotli'],
+      },
 )
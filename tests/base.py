@@ -63,6 +63,33 @@ class TestingModelDB(ModelDB):
         return 0
         
 
+class FakeComponent(object):
+    """ Stand-in for a bgmodelbuilder component or assembly, providing just
+    the accessors used to walk the assembly tree
+    """
+    def __init__(self, name, placements=()):
+        self.name = name
+        self.id = name
+        self.placements = list(placements) # (component, weight) pairs
+
+    def getcomponents(self, deep=False, withweight=False, merge=True):
+        if withweight:
+            return list(self.placements)
+        return [comp for comp, weight in self.placements]
+
+    @classmethod
+    def buildtree(cls):
+        """ Build a small nested assembly with a shared subassembly and one
+        assembly with more than 10 placements
+        Returns:
+            the root assembly
+        """
+        shared = cls('shared', [(cls('leaf2'), 5)])
+        sub = cls('sub', [(cls('leaf1'), 3), (shared, 1)])
+        big = cls('big', [(cls(f'b{i}'), 1) for i in range(1, 12)])
+        return cls('root', [(sub, 2), (shared, 4), (big, 1)])
+
+
 class BGExplorerTestCase(unittest.TestCase):
     """ Base Test case for web api.
 
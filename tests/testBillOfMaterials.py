@@ -0,0 +1,37 @@
+""" Tests for building the bill of materials rows
+"""
+from .base import BGExplorerTestCase, FakeComponent
+
+from bgexplorer.modelviewer import billofmaterials
+from flask import g
+from types import SimpleNamespace
+import unittest
+
+
+class TestBOMRows(BGExplorerTestCase):
+
+    def test_nested_assembly(self):
+        root = FakeComponent.buildtree()
+        expected = [
+            ('', ('root',), 1, 1),
+            ('1', ('root', 'sub'), 2, 2),
+            ('1.1', ('root', 'sub', 'leaf1'), 3, 6),
+            ('1.2', ('root', 'sub', 'shared'), 1, 2),
+            ('1.2.1', ('root', 'sub', 'shared', 'leaf2'), 5, 10),
+            ('2', ('root', 'shared'), 4, 4),
+            ('2.1', ('root', 'shared', 'leaf2'), 5, 20),
+            ('3', ('root', 'big'), 1, 1),
+        ] + [(f'3.{i:02d}', ('root', 'big', f'b{i}'), 1, 1)
+             for i in range(1, 12)]
+        with self.app.test_request_context():
+            g.model = SimpleNamespace(assemblyroot=root)
+            rows = [(row.outline, tuple(c.name for c in row.path),
+                     row.weight, row.totalweight)
+                    for row in billofmaterials.getbomrows()]
+            self.assertEqual(rows, expected)
+            for row in billofmaterials.getbomrows():
+                self.assertIs(row.component, row.path[-1])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,38 @@
+""" Tests for the cached helpers in SimsDbView
+"""
+from . import context  # noqa
+
+from bgexplorer.dbview import SimsDbView
+import unittest
+
+
+class TestSimsDbView(unittest.TestCase):
+
+    def setUp(self):
+        self.view = SimsDbView(groups={'Component': None},
+                               values={'rate': None},
+                               values_units={'rate': 'mBq'})
+
+    def test_datatable_header_follows_changes(self):
+        self.assertEqual(self.view.datatable_header(),
+                         'ID\tG_Component\tV_rate [mBq]\n')
+        self.view.values['mass'] = None
+        self.view.values_units['mass'] = 'kg'
+        self.assertEqual(self.view.datatable_header(),
+                         'ID\tG_Component\tV_rate [mBq]\tV_mass [kg]\n')
+        self.view.groups = {'Material': None}
+        self.assertEqual(self.view.datatable_header(),
+                         'ID\tG_Material\tV_rate [mBq]\tV_mass [kg]\n')
+
+    def test_value_spectrum_follows_changes(self):
+        self.assertIsNone(self.view.get_value_spectrum('rate [mBq]'))
+        self.view.values_spectra['rate'] = 'energy'
+        self.assertEqual(self.view.get_value_spectrum('rate'), 'energy')
+        self.assertEqual(self.view.get_value_spectrum('rate [mBq]'), 'energy')
+        self.view.values_units['rate'] = 'Bq'
+        self.assertIsNone(self.view.get_value_spectrum('rate [mBq]'))
+        self.assertEqual(self.view.get_value_spectrum('rate [Bq]'), 'energy')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,74 @@
+""" Tests for the least-recently-used InMemoryCacher
+"""
+from . import context  # noqa
+
+from bgexplorer.modeldb import InMemoryCacher
+import unittest
+import threading
+
+
+class TestInMemoryCacher(unittest.TestCase):
+
+    def test_store_get(self):
+        cache = InMemoryCacher(maxentries=2)
+        self.assertEqual(cache.store('a', 1), 'a')
+        self.assertEqual(cache.get('a'), 1)
+        self.assertTrue(cache.test('a'))
+        self.assertIsNone(cache.get('b'))
+        self.assertFalse(cache.test('b'))
+
+    def test_evicts_least_recently_used(self):
+        cache = InMemoryCacher(maxentries=2)
+        cache.store('a', 1)
+        cache.store('b', 2)
+        cache.get('a') # now 'b' is the oldest
+        cache.store('c', 3)
+        self.assertFalse(cache.test('b'))
+        self.assertEqual(cache.get('a'), 1)
+        self.assertEqual(cache.get('c'), 3)
+
+    def test_store_existing_keeps_value(self):
+        cache = InMemoryCacher(maxentries=2)
+        cache.store('a', 1)
+        cache.store('a', 2)
+        self.assertEqual(cache.get('a'), 1)
+
+    def test_expire(self):
+        cache = InMemoryCacher(maxentries=3)
+        cache.expire() # nothing to do
+        cache.store('a', 1)
+        cache.store('b', 2)
+        cache.expire('a')
+        cache.expire('missing')
+        self.assertFalse(cache.test('a'))
+        cache.expire()
+        self.assertFalse(cache.test('b'))
+        cache.store('c', 3)
+        cache.empty()
+        self.assertIsNone(cache.get('c'))
+
+    def test_threads(self):
+        cache = InMemoryCacher(maxentries=4)
+        errors = []
+        def worker(offset):
+            try:
+                for i in range(2000):
+                    key = (i + offset) % 10
+                    cache.store(key, key)
+                    val = cache.get(key)
+                    self.assertIn(val, (key, None))
+                    cache.expire(key if i % 3 else None)
+            except Exception as e:
+                errors.append(e)
+        threads = [threading.Thread(target=worker, args=(n,))
+                   for n in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+        self.assertLessEqual(len(cache.registry), 4)
+
+
+if __name__ == '__main__':
+    unittest.main()
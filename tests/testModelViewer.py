@@ -0,0 +1,152 @@
+""" Tests for the ModelViewer helpers that don't need a full app
+"""
+from . import context  # noqa
+from .base import FakeComponent
+
+from bgexplorer.modelviewer import modelviewer
+from bgexplorer.modelviewer.modelviewer import ModelViewer
+from bgexplorer.modeldb import InMemoryCacher
+from flask import Flask
+from types import SimpleNamespace
+import unittest
+import zlib
+import gzip
+import json
+
+
+class TestCachedDatatable(unittest.TestCase):
+
+    def setUp(self):
+        self.app = Flask("test_modelviewer")
+        self.viewer = ModelViewer(cacher=InMemoryCacher())
+        self.model = SimpleNamespace(id='model1',
+                                     editDetails={'date': '2020-01-01'})
+        self.table = b'ID\tValue\n1\t2\n'
+        self.viewer._cacher.store(self.viewer.datatablekey(self.model),
+                                  zlib.compress(self.table))
+
+    def tearDown(self):
+        self.viewer.shutdown()
+
+    def get(self, acceptencoding=None):
+        headers = {}
+        if acceptencoding is not None:
+            headers['Accept-Encoding'] = acceptencoding
+        with self.app.test_request_context(headers=headers):
+            response = self.viewer.get_datatable(self.model)
+            response.direct_passthrough = False
+            return response.headers['Content-Encoding'], response.get_data()
+
+    def test_deflate(self):
+        for acceptencoding in (None, 'deflate', 'gzip, deflate',
+                               'br;q=0, deflate'):
+            encoding, body = self.get(acceptencoding)
+            self.assertEqual(encoding, 'deflate', acceptencoding)
+            self.assertEqual(zlib.decompress(body), self.table)
+
+    @unittest.skipIf(modelviewer.brotli is None, "brotli is not installed")
+    def test_brotli(self):
+        for acceptencoding in ('br', 'gzip, deflate, br', 'br;q=0.5'):
+            encoding, body = self.get(acceptencoding)
+            self.assertEqual(encoding, 'br', acceptencoding)
+            self.assertEqual(modelviewer.brotli.decompress(body), self.table)
+
+
+class TestCachedExport(unittest.TestCase):
+
+    def setUp(self):
+        self.app = Flask("test_modelviewer")
+        self.viewer = ModelViewer(cacher=InMemoryCacher())
+        self.doc = {'_id': 'model1', 'name': 'test',
+                    'editDetails': {'date': '2020-01-01'}}
+        self.model = SimpleNamespace(id='model1',
+                                     editDetails={'date': '2020-01-01'},
+                                     todict=lambda: self.doc)
+
+    def tearDown(self):
+        self.viewer.shutdown()
+
+    def get(self, acceptencoding):
+        headers = {'Accept-Encoding': acceptencoding}
+        with self.app.test_request_context(headers=headers):
+            response = self.viewer.get_export(self.model)
+            self.assertEqual(response.headers.get('Vary'), 'Accept-Encoding')
+            return (response.headers.get('Content-Encoding'),
+                    response.get_data())
+
+    def test_encodings(self):
+        for acceptencoding in ('gzip', 'gzip, deflate, br', 'gzip;q=0.5'):
+            encoding, body = self.get(acceptencoding)
+            self.assertEqual(encoding, 'gzip', acceptencoding)
+            self.assertEqual(json.loads(gzip.decompress(body)), self.doc)
+        for acceptencoding in ('', 'deflate', 'gzip;q=0, deflate'):
+            encoding, body = self.get(acceptencoding)
+            self.assertIsNone(encoding, acceptencoding)
+            self.assertEqual(json.loads(body), self.doc)
+
+
+class TestComponentSort(unittest.TestCase):
+
+    def setUp(self):
+        self.viewer = ModelViewer()
+        self.root = FakeComponent.buildtree()
+
+    def tearDown(self):
+        self.viewer.shutdown()
+
+    def test_nested_assembly(self):
+        expected = (['sub', 'sub___leaf1', 'sub___shared',
+                     'sub___shared___leaf2', 'shared', 'shared___leaf2',
+                     'big']
+                    + [f'big___b{i}' for i in range(1, 12)])
+        self.assertEqual(self.viewer.get_componentsort(self.root, False),
+                         expected)
+        self.assertEqual(self.viewer.get_componentsort(self.root, False,
+                                                       memo={}),
+                         expected)
+        self.assertEqual(self.viewer.get_componentsort(self.root),
+                         ['root'] + ['root___'+name for name in expected])
+
+
+class TestModelEtags(unittest.TestCase):
+
+    class CountingModelDB(object):
+        """ Answers raw model lookups from a dict, counting them """
+        def __init__(self, models):
+            self.models = models
+            self.lookups = 0
+
+        def get_raw_model(self, query, projection=None, withmeta=False):
+            self.lookups += 1
+            return self.models.get(query)
+
+    def setUp(self):
+        def modeldict(modelid, temporary):
+            return {'_id': modelid, 'editDetails': {'date': '2020-01-01'},
+                    '__modeldb_meta': {'temporary': temporary}}
+        self.modeldb = self.CountingModelDB({
+            'saved': modeldict('saved', False),
+            'temp': modeldict('temp', True),
+        })
+        self.viewer = ModelViewer(modeldb=self.modeldb)
+
+    def tearDown(self):
+        self.viewer.shutdown()
+
+    def test_permanent_cached(self):
+        for i in range(3):
+            self.assertEqual(self.viewer.lookup_model_etag('saved'),
+                             ('saved-2020-01-01', 'saved'))
+        self.assertEqual(self.modeldb.lookups, 1)
+
+    def test_temporary_not_cached(self):
+        self.assertEqual(self.viewer.lookup_model_etag('temp'),
+                         ('temp-2020-01-01', 'temp'))
+        del self.modeldb.models['temp']
+        self.assertEqual(self.viewer.lookup_model_etag('temp'),
+                         (None, None))
+        self.assertEqual(self.modeldb.lookups, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
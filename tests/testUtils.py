@@ -0,0 +1,68 @@
+""" Tests for the helpers in bgexplorer.utils
+"""
+from . import context  # noqa
+
+from bgexplorer import utils
+import unittest
+from bson import ObjectId
+import numpy as np
+
+
+class TestDumpJson(unittest.TestCase):
+
+    def dump_both(self, obj):
+        """ Serialize `obj` with orjson (if installed) and with the json
+        module fallback
+        """
+        fast = utils.dumpjson(obj)
+        orjson, utils.orjson = utils.orjson, None
+        try:
+            slow = utils.dumpjson(obj)
+        finally:
+            utils.orjson = orjson
+        return fast, slow
+
+    def test_objectid(self):
+        oid = ObjectId()
+        for result in self.dump_both({'_id': oid, 'ids': [oid]}):
+            self.assertEqual(result,
+                             b'{"_id":"%s","ids":["%s"]}' % (str(oid).encode(),
+                                                             str(oid).encode()))
+
+    def test_nonfinite(self):
+        doc = {'a': float('nan'), 'b': [1.5, float('inf')], 'c': 'x'}
+        for result in self.dump_both(doc):
+            self.assertEqual(result, b'{"a":null,"b":[1.5,null],"c":"x"}')
+
+    def test_numpy_scalars(self):
+        doc = {'a': np.float64(1.5), 'b': [np.float32(0.25), np.int64(3)],
+               'c': np.bool_(True), 'd': np.float64('nan'),
+               'e': np.float32('inf')}
+        for result in self.dump_both(doc):
+            self.assertEqual(result,
+                             b'{"a":1.5,"b":[0.25,3],"c":true,'
+                             b'"d":null,"e":null}')
+
+    def test_float_subclass(self):
+        class Subfloat(float):
+            pass
+        doc = {'a': Subfloat(2.5), 'b': [Subfloat('nan')]}
+        for result in self.dump_both(doc):
+            self.assertEqual(result, b'{"a":2.5,"b":[null]}')
+
+    def test_unicode(self):
+        fast, slow = self.dump_both({'name': 'µ-metal'})
+        self.assertEqual(fast, slow)
+        self.assertEqual(slow, '{"name":"µ-metal"}'.encode('utf-8'))
+
+    def test_streamed_matches(self):
+        doc = {'_id': ObjectId(), True: 1, None: [2], 3: {'a': 'b'},
+               'x': float('nan')}
+        whole = utils.dumpjson(doc)
+        for chunksize in (1, 8, 65536):
+            streamed = b''.join(utils.iterdumpjson(doc, chunksize))
+            self.assertEqual(streamed, whole)
+
+
+if __name__ == '__main__':
+    unittest.main()
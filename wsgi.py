@@ -4,7 +4,10 @@ from glob import glob
 
 from bgexplorer import create_app
 
-app = create_app(sys.argv[1] if len(sys.argv)>1 else None)
+#spectrum render workers import this script again as __mp_main__;
+#they don't need an app of their own
+if __name__ != '__mp_main__':
+    app = create_app(sys.argv[1] if len(sys.argv)>1 else None)
 
 if __name__ == '__main__':
     app.config.update({'DEBUG':True,'TESTING':True, 